@@ -1,5 +1,6 @@
 import streamlit as st
 import pandas as pd
+import io
 import json
 import time
 from typing import Dict, Any
@@ -74,6 +75,85 @@ def initialize_session_state():
     if 'query_history' not in st.session_state:
         st.session_state.query_history = []
 
+@st.cache_resource
+def get_sql_agent() -> SQLAgent:
+    """Build the SQLAgent once per process and share it across sessions.
+
+    The agent owns the DB engine and Ollama client, so caching it avoids
+    re-reading config, rebuilding the LLM client and re-reflecting the
+    schema for every new browser session.
+    """
+    agent = SQLAgent()
+    agent.connect_database()
+    return agent
+
+@st.cache_data
+def df_to_csv_bytes(df: pd.DataFrame) -> bytes:
+    """CSV-encode a result frame once per unique DataFrame."""
+    return df.to_csv(index=False).encode()
+
+@st.cache_data
+def df_to_parquet_bytes(df: pd.DataFrame) -> bytes:
+    """Parquet-encode a result frame once per unique DataFrame."""
+    buf = io.BytesIO()
+    df.to_parquet(buf, engine="pyarrow")
+    return buf.getvalue()
+
+@st.fragment
+def render_settings():
+    """Model settings panel, fragment-scoped so changing a setting doesn't
+    rerun the whole page."""
+    st.subheader("⚙️ Settings")
+
+    # Model settings
+    st.selectbox(
+        "Model Temperature",
+        [0.1, 0.3, 0.5, 0.7, 0.9],
+        index=3,
+        key="temperature"
+    )
+
+    st.selectbox(
+        "Max Tokens",
+        [1024, 2048, 4096, 8192],
+        index=1,
+        key="max_tokens"
+    )
+
+@st.fragment
+def render_history():
+    """Query history panel, fragment-scoped to avoid re-rendering the
+    history loop on unrelated interactions."""
+    st.subheader("📚 Query History")
+    if st.session_state.query_history:
+        for i, (query, sql) in enumerate(st.session_state.query_history[-5:]):
+            with st.expander(f"Query {i+1}: {query[:50]}..."):
+                st.text_area("Natural Language", query, disabled=True, key=f"hist_query_{i}")
+                st.text_area("Generated SQL", sql, disabled=True, key=f"hist_sql_{i}")
+    else:
+        st.info("No query history yet.")
+
+@st.fragment
+def render_debug():
+    """Debug information panel, fragment-scoped."""
+    with st.expander("🔍 Debug Information"):
+        if 'query_result' in st.session_state:
+            st.subheader("Query Analysis")
+            result = st.session_state.query_result
+
+            col1, col2 = st.columns(2)
+
+            with col1:
+                st.write("**Relevant Tables:**")
+                st.write(result.get("relevant_tables", []))
+
+                st.write("**Schema Context:**")
+                st.text_area("Schema", result.get("schema_context", ""), height=200, disabled=True)
+
+            with col2:
+                st.write("**Crew Result:**")
+                st.text_area("Crew Output", result.get("crew_result", ""), height=300, disabled=True)
+
 def main():
     """Main application function."""
     # st.set_option('server.address', 'localhost')
@@ -96,8 +176,8 @@ def main():
             with st.spinner("Connecting to database..."):
                 try:
                     if st.session_state.sql_agent is None:
-                        st.session_state.sql_agent = SQLAgent()
-                    
+                        st.session_state.sql_agent = get_sql_agent()
+
                     if st.session_state.sql_agent.connect_database():
                         st.session_state.db_connected = True
                         st.success("✅ Database connected!")
@@ -116,8 +196,8 @@ def main():
             with st.spinner("Testing Ollama connection..."):
                 try:
                     if st.session_state.sql_agent is None:
-                        st.session_state.sql_agent = SQLAgent()
-                    
+                        st.session_state.sql_agent = get_sql_agent()
+
                     if st.session_state.sql_agent.test_ollama_connection():
                         st.session_state.ollama_connected = True
                         st.success("✅ Ollama connected!")
@@ -132,32 +212,10 @@ def main():
             st.markdown('<p class="status-warning">⚠️ Ollama: Not tested</p>', unsafe_allow_html=True)
         
         # Configuration
-        st.subheader("⚙️ Settings")
-        
-        # Model settings
-        st.selectbox(
-            "Model Temperature",
-            [0.1, 0.3, 0.5, 0.7, 0.9],
-            index=3,
-            key="temperature"
-        )
-        
-        st.selectbox(
-            "Max Tokens",
-            [1024, 2048, 4096, 8192],
-            index=1,
-            key="max_tokens"
-        )
-        
+        render_settings()
+
         # Query history
-        st.subheader("📚 Query History")
-        if st.session_state.query_history:
-            for i, (query, sql) in enumerate(st.session_state.query_history[-5:]):
-                with st.expander(f"Query {i+1}: {query[:50]}..."):
-                    st.text_area("Natural Language", query, disabled=True, key=f"hist_query_{i}")
-                    st.text_area("Generated SQL", sql, disabled=True, key=f"hist_sql_{i}")
-        else:
-            st.info("No query history yet.")
+        render_history()
     
     # Main content area
     col1, col2 = st.columns([1, 1])
@@ -184,13 +242,13 @@ def main():
             else:
                 with st.spinner("Generating SQL query..."):
                     try:
-                        # Update model parameters
-                        if st.session_state.sql_agent:
-                            st.session_state.sql_agent.ollama_manager.llm.temperature = st.session_state.temperature
-                            st.session_state.sql_agent.ollama_manager.llm.max_tokens = st.session_state.max_tokens
-                        
-                        # Generate SQL
-                        result = st.session_state.sql_agent.generate_sql(natural_language_query)
+                        # Generate SQL; model parameters are passed per
+                        # request since the agent is shared across sessions
+                        result = st.session_state.sql_agent.generate_sql(
+                            natural_language_query,
+                            temperature=st.session_state.temperature,
+                            max_tokens=st.session_state.max_tokens
+                        )
                         
                         if result["success"]:
                             # Store in session state
@@ -258,38 +316,28 @@ def main():
         
         # Display results in a table
         if result["data"]:
-            df = pd.DataFrame(result["data"])
+            df = pd.DataFrame(result["data"], columns=result["columns"])
             st.dataframe(df, use_container_width=True)
             
-            # Download button
-            csv = df.to_csv(index=False)
+            # Download buttons (encoded bytes are cached per DataFrame so
+            # reruns don't re-serialize an unchanged result)
             st.download_button(
                 label="📥 Download Results as CSV",
-                data=csv,
+                data=df_to_csv_bytes(df),
                 file_name="query_results.csv",
                 mime="text/csv"
             )
+            st.download_button(
+                label="📥 Download Results as Parquet",
+                data=df_to_parquet_bytes(df),
+                file_name="query_results.parquet",
+                mime="application/octet-stream"
+            )
         else:
             st.info("Query returned no results.")
     
     # Debug information (expandable)
-    with st.expander("🔍 Debug Information"):
-        if 'query_result' in st.session_state:
-            st.subheader("Query Analysis")
-            result = st.session_state.query_result
-            
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                st.write("**Relevant Tables:**")
-                st.write(result.get("relevant_tables", []))
-                
-                st.write("**Schema Context:**")
-                st.text_area("Schema", result.get("schema_context", ""), height=200, disabled=True)
-            
-            with col2:
-                st.write("**Crew Result:**")
-                st.text_area("Crew Output", result.get("crew_result", ""), height=300, disabled=True)
+    render_debug()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -1,16 +1,270 @@
+import functools
 import json
+import os
+import re
 # from pydoc import text
 import psycopg2
 from psycopg2.extras import RealDictCursor
-from sqlalchemy import create_engine, MetaData, inspect, text
+from sqlalchemy import create_engine, MetaData, inspect, select, text
 from sqlalchemy.engine import URL
 import pandas as pd
+import streamlit as st
+from io import StringIO
 from typing import Dict, List, Optional, Any
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+@functools.lru_cache(maxsize=8)
+def _load_json(path: str, mtime: float) -> Dict[str, Any]:
+    """Load and parse a JSON file, memoized on (path, mtime).
+
+    The mtime key means edits to the file still invalidate the cache,
+    while repeated instantiations skip the disk read and JSON parse.
+    """
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+@st.cache_resource
+def _get_engine(config_items: tuple):
+    """Create the SQLAlchemy engine and reflected metadata once per config.
+
+    Streamlit re-runs the whole script on every interaction, so without
+    caching we would rebuild the engine and re-reflect the schema on each
+    rerun. config_items is the database config as a sorted tuple of items
+    so it is hashable for the cache key.
+    """
+    db_config = dict(config_items)
+
+    url = URL.create(
+        drivername="postgresql+psycopg2",
+        username=db_config['username'],
+        password=db_config['password'],
+        host=db_config['host'],
+        port=db_config['port'],
+        database=db_config['database']
+    )
+    # Explicit QueuePool settings so connections are reused across queries
+    # instead of paying TCP/auth handshakes per call; pool_pre_ping replaces
+    # the old "SELECT 1" probe and also revalidates stale pooled connections
+    engine = create_engine(
+        url,
+        pool_size=10,
+        max_overflow=20,
+        pool_pre_ping=True,
+        pool_recycle=1800,
+        pool_timeout=5
+    )
+
+    # Load metadata
+    metadata = MetaData()
+    metadata.reflect(bind=engine)
+
+    return engine, metadata
+
+
+# Bulk catalog queries: three round-trips for the whole schema instead of
+# three inspector calls per table
+_COLUMNS_SQL = """
+    SELECT table_name, column_name, data_type, is_nullable, column_default
+    FROM information_schema.columns
+    WHERE table_schema = current_schema()
+    ORDER BY table_name, ordinal_position
+"""
+
+_PRIMARY_KEYS_SQL = """
+    SELECT tc.table_name, kcu.column_name
+    FROM information_schema.table_constraints tc
+    JOIN information_schema.key_column_usage kcu
+        ON tc.constraint_name = kcu.constraint_name
+        AND tc.table_schema = kcu.table_schema
+    WHERE tc.constraint_type = 'PRIMARY KEY'
+        AND tc.table_schema = current_schema()
+    ORDER BY tc.table_name, kcu.ordinal_position
+"""
+
+_FOREIGN_KEYS_SQL = """
+    SELECT tc.table_name, tc.constraint_name, kcu.column_name,
+           ccu.table_name AS referred_table, ccu.column_name AS referred_column
+    FROM information_schema.table_constraints tc
+    JOIN information_schema.key_column_usage kcu
+        ON tc.constraint_name = kcu.constraint_name
+        AND tc.table_schema = kcu.table_schema
+    JOIN information_schema.constraint_column_usage ccu
+        ON tc.constraint_name = ccu.constraint_name
+        AND tc.table_schema = ccu.table_schema
+    WHERE tc.constraint_type = 'FOREIGN KEY'
+        AND tc.table_schema = current_schema()
+    ORDER BY tc.table_name, kcu.ordinal_position
+"""
+
+
+# Scoped variants of the bulk queries, for fetching a handful of tables
+# without pulling the whole catalog; psycopg2 adapts the list parameter
+# to a Postgres array for ANY()
+_SCOPED_COLUMNS_SQL = """
+    SELECT table_name, column_name, data_type, is_nullable, column_default
+    FROM information_schema.columns
+    WHERE table_schema = current_schema()
+        AND table_name = ANY(%(tables)s)
+    ORDER BY table_name, ordinal_position
+"""
+
+_SCOPED_PRIMARY_KEYS_SQL = """
+    SELECT tc.table_name, kcu.column_name
+    FROM information_schema.table_constraints tc
+    JOIN information_schema.key_column_usage kcu
+        ON tc.constraint_name = kcu.constraint_name
+        AND tc.table_schema = kcu.table_schema
+    WHERE tc.constraint_type = 'PRIMARY KEY'
+        AND tc.table_schema = current_schema()
+        AND tc.table_name = ANY(%(tables)s)
+    ORDER BY tc.table_name, kcu.ordinal_position
+"""
+
+_SCOPED_FOREIGN_KEYS_SQL = """
+    SELECT tc.table_name, tc.constraint_name, kcu.column_name,
+           ccu.table_name AS referred_table, ccu.column_name AS referred_column
+    FROM information_schema.table_constraints tc
+    JOIN information_schema.key_column_usage kcu
+        ON tc.constraint_name = kcu.constraint_name
+        AND tc.table_schema = kcu.table_schema
+    JOIN information_schema.constraint_column_usage ccu
+        ON tc.constraint_name = ccu.constraint_name
+        AND tc.table_schema = ccu.table_schema
+    WHERE tc.constraint_type = 'FOREIGN KEY'
+        AND tc.table_schema = current_schema()
+        AND tc.table_name = ANY(%(tables)s)
+    ORDER BY tc.table_name, kcu.ordinal_position
+"""
+
+
+def _assemble_schema_info(columns_df: pd.DataFrame, pk_df: pd.DataFrame,
+                          fk_df: pd.DataFrame) -> Dict[str, Any]:
+    """Build the nested schema dict from the three catalog frames."""
+    schema_info = {
+        "tables": {},
+        "relationships": [],
+        "total_tables": 0
+    }
+
+    for row in columns_df.itertuples():
+        table_info = schema_info["tables"].setdefault(row.table_name, {
+            "name": row.table_name,
+            "columns": [],
+            "primary_keys": [],
+            "foreign_keys": []
+        })
+        table_info["columns"].append({
+            "name": row.column_name,
+            "type": row.data_type,
+            "nullable": row.is_nullable == "YES",
+            "default": row.column_default
+        })
+
+    for row in pk_df.itertuples():
+        table_info = schema_info["tables"].get(row.table_name)
+        if table_info is not None:
+            table_info["primary_keys"].append(row.column_name)
+
+    # One FK constraint can span several columns; regroup per constraint
+    for (table_name, _), group in fk_df.groupby(["table_name", "constraint_name"], sort=False):
+        table_info = schema_info["tables"].get(table_name)
+        if table_info is not None:
+            table_info["foreign_keys"].append({
+                "constrained_columns": group["column_name"].tolist(),
+                "referred_table": group["referred_table"].iloc[0],
+                "referred_columns": group["referred_column"].tolist()
+            })
+
+    schema_info["total_tables"] = len(schema_info["tables"])
+
+    return schema_info
+
+
+@st.cache_data(ttl=3600)
+def _get_schema_cached(config_key: tuple, _engine) -> Dict[str, Any]:
+    """Extract database schema information, cached per database config.
+
+    Uses three bulk information_schema queries (columns, PKs, FKs) instead
+    of per-table inspector calls, so the catalog round-trips stay constant
+    regardless of table count. The engine argument is underscore-prefixed
+    so Streamlit keys the cache on config_key only instead of trying to
+    hash the engine object.
+    """
+    return _assemble_schema_info(
+        pd.read_sql_query(_COLUMNS_SQL, _engine),
+        pd.read_sql_query(_PRIMARY_KEYS_SQL, _engine),
+        pd.read_sql_query(_FOREIGN_KEYS_SQL, _engine),
+    )
+
+
+def _build_table_blocks(schema_info: Dict[str, Any]) -> Dict[str, str]:
+    """Pre-render the per-table context block used in LLM prompts.
+
+    Serializing each table once at schema-load time turns per-query
+    context building into a dict lookup plus a join.
+    """
+    blocks = {}
+
+    for table_name, table_info in schema_info["tables"].items():
+        primary_keys = table_info["primary_keys"]
+        foreign_keys = table_info["foreign_keys"]
+
+        buf = StringIO()
+        buf.write(f"Table: {table_name}\nColumns:\n")
+        # Unpack each column dict once instead of four lookups per line
+        buf.write("\n".join(
+            f"  - {name}: {typ} "
+            f"{'NULL' if nullable else 'NOT NULL'}"
+            f"{' DEFAULT ' + str(default) if default else ''}"
+            for name, typ, nullable, default in (
+                (col["name"], col["type"], col["nullable"], col["default"])
+                for col in table_info["columns"])))
+
+        if primary_keys:
+            buf.write(f"\nPrimary Keys: {', '.join(primary_keys)}")
+
+        if foreign_keys:
+            buf.write("\nForeign Keys: ")
+            buf.write("; ".join(
+                f"{', '.join(fk['constrained_columns'])} -> "
+                f"{fk['referred_table']}.{', '.join(fk['referred_columns'])}"
+                for fk in foreign_keys))
+
+        blocks[table_name] = buf.getvalue()
+
+    return blocks
+
+
+def _build_schema_prompt(schema_info: Dict[str, Any]) -> str:
+    """Render the schema dict as a compact, LLM-ready text block.
+
+    One line per column and one per foreign key keeps the token footprint
+    small, and building it once at connect time avoids re-serializing the
+    nested schema dict for every prompt.
+    """
+    buf = StringIO()
+
+    for table_name, table_info in schema_info["tables"].items():
+        for col in table_info["columns"]:
+            name, typ = col["name"], col["type"]
+            nullable = "" if col["nullable"] else " NOT NULL"
+            buf.write(f"{table_name}.{name} {typ}{nullable}\n")
+
+        if table_info["primary_keys"]:
+            buf.write(f"{table_name} PRIMARY KEY ({', '.join(table_info['primary_keys'])})\n")
+
+        for fk in table_info["foreign_keys"]:
+            buf.write(f"{table_name}.{', '.join(fk['constrained_columns'])} -> "
+                      f"{fk['referred_table']}.{', '.join(fk['referred_columns'])}\n")
+
+    return buf.getvalue()
+
+
 class DatabaseManager:
     def __init__(self, config_path: str = "config/database_config.json"):
         """Initialize database manager with configuration."""
@@ -18,12 +272,18 @@ class DatabaseManager:
         self.connection = None
         self.engine = None
         self.metadata = None
+        self._config_key = None
+        self._table_names = []
+        self._table_by_lc = {}
+        self._table_re = None
+        self._table_tokens = {}
+        self._schema_blocks = {}
+        self.schema_prompt = ""
         
     def _load_config(self, config_path: str) -> Dict[str, Any]:
         """Load database configuration from JSON file."""
         try:
-            with open(config_path, 'r') as f:
-                return json.load(f)
+            return _load_json(config_path, os.path.getmtime(config_path))
         except FileNotFoundError:
             logger.error(f"Configuration file not found: {config_path}")
             raise
@@ -35,112 +295,125 @@ class DatabaseManager:
         """Establish connection to PostgreSQL database."""
         try:
             db_config = self.config['database']
-            
-            # Create SQLAlchemy engine
-            url = URL.create(
-                drivername="postgresql+psycopg2",
-                username=db_config['username'],
-                password=db_config['password'],
-                host=db_config['host'],
-                port=db_config['port'],
-                database=db_config['database']
-            )
-            print(url)
-
-         
-            self.engine = create_engine(url)
-            
-            # Test connection
-            with self.engine.connect() as conn:
-                conn.execute(text("SELECT 1"))
-            
-            # Load metadata
-            self.metadata = MetaData()
-            self.metadata.reflect(bind=self.engine)
-            
+
+            # Engine and reflected metadata are cached per config so reruns
+            # reuse them instead of reconnecting and re-reflecting
+            self._config_key = tuple(sorted(db_config.items()))
+            self.engine, self.metadata = _get_engine(self._config_key)
+
+            # Cache table names once so query-time lookups avoid a catalog
+            # round-trip; a single alternation regex turns T substring
+            # scans per query into one linear scan
+            self._table_names = list(self.metadata.tables.keys())
+            self._table_by_lc = {t.lower(): t for t in self._table_names}
+            if self._table_names:
+                alternation = "|".join(map(re.escape, sorted(
+                    self._table_names, key=len, reverse=True)))
+                self._table_re = re.compile(
+                    r"\b(" + alternation + r")\b", re.IGNORECASE)
+
+            # Token profile per table (name fragments + column names),
+            # precomputed once so the relevance fallback ranks tables by
+            # overlap with the query instead of scanning the catalog
+            for table_name, table in self.metadata.tables.items():
+                tokens = set(re.split(r"[_\W]+", table_name.lower()))
+                tokens.update(column.name.lower() for column in table.columns)
+                tokens.discard("")
+                self._table_tokens[table_name] = tokens
+
+            # Precompute the LLM-ready schema text and per-table context
+            # blocks once instead of rebuilding them for every prompt
+            schema_info = _get_schema_cached(self._config_key, self.engine)
+            self.schema_prompt = _build_schema_prompt(schema_info)
+            self._schema_blocks = _build_table_blocks(schema_info)
+
             logger.info("Database connection established successfully")
             return True
-            
+
         except Exception as e:
             logger.error(f"Failed to connect to database: {str(e)}")
             return False
     
     def get_database_schema(self) -> Dict[str, Any]:
-        """Extract database schema information."""
+        """Extract database schema information (cached across reruns)."""
         if not self.engine:
             raise Exception("Database not connected. Call connect() first.")
-        
-        schema_info = {
-            "tables": {},
-            "relationships": [],
-            "total_tables": 0
-        }
-        
+
         try:
-            inspector = inspect(self.engine)
-            
-            for table_name in inspector.get_table_names():
-                table_info = {
-                    "name": table_name,
-                    "columns": [],
-                    "primary_keys": [],
-                    "foreign_keys": []
-                }
-                
-                # Get columns
-                for column in inspector.get_columns(table_name):
-                    table_info["columns"].append({
-                        "name": column['name'],
-                        "type": str(column['type']),
-                        "nullable": column['nullable'],
-                        "default": column['default']
-                    })
-                
-                # Get primary keys
-                pk_constraint = inspector.get_pk_constraint(table_name)
-                if pk_constraint['constrained_columns']:
-                    table_info["primary_keys"] = pk_constraint['constrained_columns']
-                
-                # Get foreign keys
-                fk_constraints = inspector.get_foreign_keys(table_name)
-                for fk in fk_constraints:
-                    table_info["foreign_keys"].append({
-                        "constrained_columns": fk['constrained_columns'],
-                        "referred_table": fk['referred_table'],
-                        "referred_columns": fk['referred_columns']
-                    })
-                
-                schema_info["tables"][table_name] = table_info
-            
-            schema_info["total_tables"] = len(schema_info["tables"])
-            
-            return schema_info
-            
+            return _get_schema_cached(self._config_key, self.engine)
         except Exception as e:
             logger.error(f"Error extracting schema: {str(e)}")
             raise
     
+    def get_tables_schema(self, table_names: List[str]) -> Dict[str, Any]:
+        """Schema information for just the named tables.
+
+        Issues the scoped catalog queries (WHERE table_name = ANY(...))
+        so only the requested tables' rows cross the wire, instead of
+        materializing the whole catalog for a handful of tables.
+        """
+        if not self.engine:
+            raise Exception("Database not connected. Call connect() first.")
+
+        names = list(table_names)
+        if not names:
+            return {"tables": {}, "relationships": [], "total_tables": 0}
+
+        params = {"tables": names}
+        return _assemble_schema_info(
+            pd.read_sql_query(_SCOPED_COLUMNS_SQL, self.engine, params=params),
+            pd.read_sql_query(_SCOPED_PRIMARY_KEYS_SQL, self.engine, params=params),
+            pd.read_sql_query(_SCOPED_FOREIGN_KEYS_SQL, self.engine, params=params),
+        )
+
+    def get_schema_text_blocks(self, table_names: Optional[List[str]] = None) -> Dict[str, str]:
+        """Return the pre-rendered per-table context blocks.
+
+        When table_names is given, any without a rendered block (e.g.
+        tables created after connect) are fetched with one scoped
+        catalog query and rendered on the spot.
+        """
+        if not self.engine:
+            raise Exception("Database not connected. Call connect() first.")
+
+        if table_names:
+            missing = [name for name in table_names
+                       if name not in self._schema_blocks]
+            if missing:
+                self._schema_blocks.update(
+                    _build_table_blocks(self.get_tables_schema(missing)))
+
+        return self._schema_blocks
+
     def get_relevant_tables(self, query: str) -> List[str]:
         """Extract relevant table names from a natural language query."""
         if not self.engine:
             raise Exception("Database not connected. Call connect() first.")
         
-        inspector = inspect(self.engine)
-        all_tables = inspector.get_table_names()
-        
-        # Simple keyword-based table matching
-        query_lower = query.lower()
-        relevant_tables = []
-        
-        for table in all_tables:
-            if table.lower() in query_lower:
-                relevant_tables.append(table)
-        
-        # If no direct matches, return all tables for broader context
-        if not relevant_tables:
-            relevant_tables = all_tables[:5]  # Limit to first 5 tables
-        
-        return relevant_tables
+        # One pass over the query with the connect-time alternation regex
+        if self._table_re is None:
+            return []
+
+        matched = {self._table_by_lc[m.lower()]
+                   for m in self._table_re.findall(query)}
+        if matched:
+            return list(matched)
+
+        # No table name appears verbatim: rank tables by token overlap
+        # between the query words and each table's name/column profile
+        query_tokens = set(re.split(r"[_\W]+", query.lower()))
+        query_tokens.discard("")
+        scored = sorted(
+            ((len(tokens & query_tokens), table)
+             for table, tokens in self._table_tokens.items()),
+            key=lambda pair: pair[0], reverse=True
+        )
+        ranked = [table for score, table in scored[:5] if score > 0]
+        if ranked:
+            return ranked
+
+        # Still nothing: return the first tables for broader context
+        return self._table_names[:5]  # Limit to first 5 tables
     
     def execute_query(self, sql_query: str) -> Optional[pd.DataFrame]:
         """Execute SQL query and return results as DataFrame."""
@@ -148,8 +421,17 @@ class DatabaseManager:
             raise Exception("Database not connected. Call connect() first.")
         
         try:
-            df = pd.read_sql_query(sql_query, self.engine)
-            return df
+            # stream_results uses a server-side cursor so rows arrive in
+            # chunks instead of materializing the whole result twice
+            chunks = pd.read_sql_query(
+                text(sql_query),
+                self.engine.execution_options(stream_results=True),
+                chunksize=10_000
+            )
+            frames = list(chunks)
+            if not frames:
+                return pd.DataFrame()
+            return pd.concat(frames, ignore_index=True)
         except Exception as e:
             logger.error(f"Error executing query: {str(e)}")
             raise
@@ -160,8 +442,16 @@ class DatabaseManager:
             raise Exception("Database not connected. Call connect() first.")
         
         try:
-            query = f"SELECT * FROM {table_name} LIMIT {limit}"
-            return pd.read_sql_query(query, self.engine)
+            # Resolve the table through reflected metadata so the identifier
+            # is validated/quoted and the limit is a bound parameter,
+            # letting Postgres reuse the prepared plan across calls
+            table = self.metadata.tables.get(table_name)
+            if table is None:
+                logger.error(f"Unknown table: {table_name}")
+                return None
+
+            stmt = select(table).limit(limit)
+            return pd.read_sql_query(stmt, self.engine)
         except Exception as e:
             logger.error(f"Error getting sample data from {table_name}: {str(e)}")
             return None
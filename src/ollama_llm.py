@@ -1,6 +1,14 @@
+import asyncio
+import functools
 import json
-import requests
-from typing import Dict, Any, List, Optional
+import hashlib
+import os
+import threading
+import weakref
+import httpx
+import sqlglot
+import streamlit as st
+from typing import Dict, Any, Iterator, List, Optional
 import logging
 from langchain.llms.base import LLM
 # from langchain.callbacks.manager import CallbackManagerForLLM
@@ -8,6 +16,164 @@ from pydantic import BaseModel, Field
 
 logger = logging.getLogger(__name__)
 
+
+@functools.lru_cache(maxsize=8)
+def _load_json(path: str, mtime: float) -> Dict[str, Any]:
+    """Load and parse a JSON file, memoized on (path, mtime)."""
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+# Shared HTTP/2 client so every Ollama call reuses a kept-alive connection
+# instead of paying a fresh handshake per request; HTTP/2 also lets
+# concurrent sessions multiplex over one TCP connection
+_CLIENT = httpx.Client(
+    http2=True,
+    timeout=60,
+    transport=httpx.HTTPTransport(retries=2),
+    limits=httpx.Limits(max_keepalive_connections=16)
+)
+
+# Async clients for overlapping independent LLM calls (e.g. generate +
+# validate) with asyncio.gather. Pooled connections belong to the event
+# loop they were opened on, and callers like SQLAgent.generate_sql spin
+# up a fresh loop per call via asyncio.run — reusing a connection from
+# an earlier, closed loop dies with "Event loop is closed" — so one
+# client is kept per running loop (weak keys let dead loops and their
+# clients be collected)
+_ASYNC_CLIENTS: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def _get_async_client() -> httpx.AsyncClient:
+    """Return the AsyncClient bound to the current running loop."""
+    loop = asyncio.get_running_loop()
+    client = _ASYNC_CLIENTS.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            http2=True,
+            timeout=60,
+            limits=httpx.Limits(max_keepalive_connections=8)
+        )
+        _ASYNC_CLIENTS[loop] = client
+    return client
+
+
+async def _apost_generate(base_url: str, model: str, prompt: str,
+                          temperature: float, max_tokens: int) -> str:
+    """Async counterpart of _post_generate."""
+    try:
+        response = await _get_async_client().post(
+            f"{base_url}/api/generate",
+            json={
+                "model": model,
+                "prompt": prompt,
+                "stream": False,
+                "options": {
+                    "temperature": temperature,
+                    "num_predict": max_tokens
+                }
+            }
+        )
+
+        if response.status_code == 200:
+            return response.json().get("response", "")
+        else:
+            logger.error(f"Ollama API error: {response.status_code} - {response.text}")
+            return "Error: Unable to generate response from Ollama model."
+
+    except httpx.HTTPError as e:
+        logger.error(f"Request error: {str(e)}")
+        return f"Error: Failed to connect to Ollama at {base_url}"
+
+
+def _sha1_digest(s: str) -> str:
+    """Digest large strings so cache-key comparison stays O(1)."""
+    return hashlib.sha1(s.encode("utf-8", "ignore")).hexdigest()
+
+
+def _post_generate(base_url: str, model: str, prompt: str,
+                   temperature: float, max_tokens: int) -> str:
+    """Issue a blocking /api/generate request against Ollama."""
+    try:
+        response = _CLIENT.post(
+            f"{base_url}/api/generate",
+            json={
+                "model": model,
+                "prompt": prompt,
+                "stream": False,
+                "options": {
+                    "temperature": temperature,
+                    "num_predict": max_tokens
+                }
+            }
+        )
+
+        if response.status_code == 200:
+            result = response.json()
+            return result.get("response", "")
+        else:
+            logger.error(f"Ollama API error: {response.status_code} - {response.text}")
+            return "Error: Unable to generate response from Ollama model."
+
+    except httpx.HTTPError as e:
+        logger.error(f"Request error: {str(e)}")
+        return f"Error: Failed to connect to Ollama at {base_url}"
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        return f"Error: {str(e)}"
+
+
+# Static prompt fragments built once at import; the per-call prompt is a
+# single join so the large invariant prose is never re-copied piecewise
+_PROMPT_PREFIX = """You are an expert SQL developer. Your task is to convert natural language queries into valid PostgreSQL SQL statements.
+
+Database Schema Context:
+"""
+
+_EXAMPLES_HDR = """
+
+Example Queries for Reference:
+"""
+
+_INSTRUCTIONS = """
+
+Instructions:
+1. Analyze the user's natural language query
+2. Use the provided database schema to understand table structures and relationships
+3. Generate a valid PostgreSQL SQL query
+4. Ensure the query is syntactically correct and follows PostgreSQL conventions
+5. Use appropriate JOINs when multiple tables are involved
+6. Include proper WHERE clauses for filtering
+7. Use appropriate aggregation functions when needed
+8. Return ONLY the SQL query, no explanations or additional text
+
+User Query: """
+
+_TAIL = """
+
+SQL Query:"""
+
+
+def _build_sql_prompt(prompt: str, schema_context: str, examples: str) -> str:
+    """Assemble the full NL-to-SQL system prompt with one join."""
+    return "".join((_PROMPT_PREFIX, schema_context, _EXAMPLES_HDR, examples,
+                    _INSTRUCTIONS, prompt, _TAIL))
+
+
+@st.cache_data(ttl=3600, max_entries=512, show_spinner=False,
+               hash_funcs={str: _sha1_digest})
+def _cached_generate(prompt: str, schema_context: str, examples: str,
+                     base_url: str, model: str, temperature: float,
+                     max_tokens: int) -> str:
+    """Generate SQL for a prompt, memoized on (prompt, schema, params).
+
+    Re-clicking Generate or repeating the same question skips the
+    expensive LLM round-trip entirely.
+    """
+    system_prompt = _build_sql_prompt(prompt, schema_context, examples)
+    return _post_generate(base_url, model, system_prompt, temperature, max_tokens)
+
+
 class OllamaLLM(LLM, BaseModel):
     """Custom LLM class for Ollama integration."""
     
@@ -27,34 +193,51 @@ class OllamaLLM(LLM, BaseModel):
         run_manager = None,
     ) -> str:
         """Generate response from Ollama model."""
+        return _post_generate(self.base_url, self.model, prompt,
+                              self.temperature, self.max_tokens)
+
+    def _call_stream(self, prompt: str) -> Iterator[str]:
+        """Yield response chunks from Ollama as they are generated.
+
+        Streaming lets the UI show the first token after one decode step
+        instead of blocking for the full response.
+        """
         try:
-            response = requests.post(
+            with _CLIENT.stream(
+                "POST",
                 f"{self.base_url}/api/generate",
                 json={
                     "model": self.model,
                     "prompt": prompt,
-                    "stream": False,
+                    "stream": True,
                     "options": {
                         "temperature": self.temperature,
                         "num_predict": self.max_tokens
                     }
-                },
-                timeout=60
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                return result.get("response", "")
-            else:
-                logger.error(f"Ollama API error: {response.status_code} - {response.text}")
-                return "Error: Unable to generate response from Ollama model."
-                
-        except requests.exceptions.RequestException as e:
+                }
+            ) as response:
+                if response.status_code != 200:
+                    logger.error(f"Ollama API error: {response.status_code}")
+                    yield "Error: Unable to generate response from Ollama model."
+                    return
+
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get("response"):
+                        yield chunk["response"]
+                    if chunk.get("done"):
+                        break
+
+        except httpx.HTTPError as e:
             logger.error(f"Request error: {str(e)}")
-            return f"Error: Failed to connect to Ollama at {self.base_url}"
-        except Exception as e:
-            logger.error(f"Unexpected error: {str(e)}")
-            return f"Error: {str(e)}"
+            yield f"Error: Failed to connect to Ollama at {self.base_url}"
+
+    async def _acall(self, prompt: str) -> str:
+        """Async generate, usable with asyncio.gather for concurrent calls."""
+        return await _apost_generate(self.base_url, self.model, prompt,
+                                     self.temperature, self.max_tokens)
     
     @property
     def _identifying_params(self) -> Dict[str, Any]:
@@ -78,12 +261,25 @@ class OllamaManager:
             base_url=self.base_url,
             model=self.model
         )
+        # Warm-load the model off the critical path so the first real
+        # request doesn't pay Ollama's cold-start
+        threading.Thread(target=self._warm, daemon=True).start()
+
+    def _warm(self):
+        """Issue an empty generate request to pin the model in memory."""
+        try:
+            _CLIENT.post(
+                f"{self.base_url}/api/generate",
+                json={"model": self.model, "prompt": "", "keep_alive": "30m"}
+            )
+            logger.info(f"Warmed Ollama model {self.model}")
+        except Exception as e:
+            logger.warning(f"Model warm-up failed: {str(e)}")
     
     def _load_config(self, config_path: str) -> Dict[str, Any]:
         """Load configuration from JSON file."""
         try:
-            with open(config_path, 'r') as f:
-                return json.load(f)
+            return _load_json(config_path, os.path.getmtime(config_path))
         except FileNotFoundError:
             logger.error(f"Configuration file not found: {config_path}")
             raise
@@ -94,7 +290,7 @@ class OllamaManager:
     def test_connection(self) -> bool:
         """Test connection to Ollama service."""
         try:
-            response = requests.get(f"{self.base_url}/api/tags", timeout=10)
+            response = _CLIENT.get(f"{self.base_url}/api/tags", timeout=10)
             if response.status_code == 200:
                 models = response.json().get("models", [])
                 model_names = [model.get("name", "") for model in models]
@@ -109,45 +305,59 @@ class OllamaManager:
                 logger.error(f"Failed to connect to Ollama: {response.status_code}")
                 return False
                 
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Connection error: {str(e)}")
             return False
     
-    def generate_sql(self, prompt: str, schema_context: str, examples: str = "") -> str:
-        """Generate SQL query from natural language prompt."""
-        
-        system_prompt = f"""You are an expert SQL developer. Your task is to convert natural language queries into valid PostgreSQL SQL statements.
-
-Database Schema Context:
-{schema_context}
-
-Example Queries for Reference:
-{examples}
-
-Instructions:
-1. Analyze the user's natural language query
-2. Use the provided database schema to understand table structures and relationships
-3. Generate a valid PostgreSQL SQL query
-4. Ensure the query is syntactically correct and follows PostgreSQL conventions
-5. Use appropriate JOINs when multiple tables are involved
-6. Include proper WHERE clauses for filtering
-7. Use appropriate aggregation functions when needed
-8. Return ONLY the SQL query, no explanations or additional text
-
-User Query: {prompt}
-
-SQL Query:"""
+    def generate_sql(self, prompt: str, schema_context: str, examples: str = "",
+                     temperature: Optional[float] = None,
+                     max_tokens: Optional[int] = None) -> str:
+        """Generate SQL query from natural language prompt (memoized).
 
+        Safe to call from concurrent session threads without locking:
+        the module-level httpx client is thread-safe and nothing here
+        mutates shared manager state. Per-request temperature/max_tokens
+        override the client defaults, so callers never need to mutate
+        the shared llm instance.
+        """
         try:
-            response = self.llm._call(system_prompt)
+            response = _cached_generate(
+                prompt, schema_context, examples,
+                self.base_url, self.model,
+                self.llm.temperature if temperature is None else temperature,
+                self.llm.max_tokens if max_tokens is None else max_tokens
+            )
             return response.strip()
         except Exception as e:
             logger.error(f"Error generating SQL: {str(e)}")
             return f"Error: Failed to generate SQL query - {str(e)}"
+
+    def generate_sql_stream(self, prompt: str, schema_context: str,
+                            examples: str = "") -> Iterator[str]:
+        """Stream SQL generation token-by-token (for st.write_stream)."""
+        system_prompt = _build_sql_prompt(prompt, schema_context, examples)
+        yield from self.llm._call_stream(system_prompt)
     
-    def validate_sql(self, sql_query: str) -> Dict[str, Any]:
-        """Validate generated SQL query."""
-        validation_prompt = f"""Validate the following PostgreSQL SQL query. Check for:
+    async def agenerate_sql(self, prompt: str, schema_context: str,
+                            examples: str = "",
+                            temperature: Optional[float] = None,
+                            max_tokens: Optional[int] = None) -> str:
+        """Async variant of generate_sql for use with asyncio.gather."""
+        system_prompt = _build_sql_prompt(prompt, schema_context, examples)
+        try:
+            response = await _apost_generate(
+                self.base_url, self.model, system_prompt,
+                self.llm.temperature if temperature is None else temperature,
+                self.llm.max_tokens if max_tokens is None else max_tokens
+            )
+            return response.strip()
+        except Exception as e:
+            logger.error(f"Error generating SQL: {str(e)}")
+            return f"Error: Failed to generate SQL query - {str(e)}"
+
+    def _build_validation_prompt(self, sql_query: str) -> str:
+        """Build the prompt used for LLM-based SQL validation."""
+        return f"""Validate the following PostgreSQL SQL query. Check for:
 1. Syntax errors
 2. Missing semicolon
 3. Proper table and column names
@@ -162,18 +372,58 @@ Provide validation result in JSON format:
     "suggestions": ["list of suggestions if any"]
 }}"""
 
+    def _parse_validation_response(self, response: str) -> Dict[str, Any]:
+        """Parse the JSON validation response from the LLM."""
         try:
-            response = self.llm._call(validation_prompt)
-            # Try to parse JSON response
-            try:
-                import json
-                return json.loads(response)
-            except json.JSONDecodeError:
-                return {
-                    "is_valid": True,
-                    "errors": [],
-                    "suggestions": ["Could not parse validation response"]
-                }
+            return json.loads(response)
+        except json.JSONDecodeError:
+            return {
+                "is_valid": True,
+                "errors": [],
+                "suggestions": ["Could not parse validation response"]
+            }
+
+    def _validate_locally(self, sql_query: str) -> Optional[Dict[str, Any]]:
+        """Syntax-check the SQL with sqlglot; None means fall back to the LLM.
+
+        Parsing locally takes microseconds versus a full Ollama round-trip,
+        so the second LLM call disappears on the happy path.
+        """
+        try:
+            sqlglot.parse_one(sql_query, read="postgres")
+            return {"is_valid": True, "errors": [], "suggestions": []}
+        except sqlglot.errors.SqlglotError as e:
+            # SqlglotError covers TokenizeError as well as ParseError —
+            # e.g. an unterminated string literal tokenizes, not parses
+            logger.info(f"Local SQL parse failed, falling back to LLM validation: {str(e)}")
+            return None
+
+    def validate_sql(self, sql_query: str) -> Dict[str, Any]:
+        """Validate generated SQL query."""
+        local_result = self._validate_locally(sql_query)
+        if local_result is not None:
+            return local_result
+
+        try:
+            response = self.llm._call(self._build_validation_prompt(sql_query))
+            return self._parse_validation_response(response)
+        except Exception as e:
+            logger.error(f"Error validating SQL: {str(e)}")
+            return {
+                "is_valid": False,
+                "errors": [f"Validation failed: {str(e)}"],
+                "suggestions": []
+            }
+
+    async def avalidate_sql(self, sql_query: str) -> Dict[str, Any]:
+        """Async variant of validate_sql for use with asyncio.gather."""
+        local_result = self._validate_locally(sql_query)
+        if local_result is not None:
+            return local_result
+
+        try:
+            response = await self.llm._acall(self._build_validation_prompt(sql_query))
+            return self._parse_validation_response(response)
         except Exception as e:
             logger.error(f"Error validating SQL: {str(e)}")
             return {
@@ -1,36 +1,226 @@
+import asyncio
+import hashlib
 import json
 import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
 from typing import Dict, Any, List, Optional, Tuple
 from crewai import Agent, Task, Crew, Process
 from src.database_manager import DatabaseManager
-from src.ollama_llm import OllamaManager, OllamaLLM
+from src.ollama_llm import OllamaLLM, OllamaManager
 import re
+import sqlglot
+import sqlite3
+import string
+import threading
 from io import BytesIO
 import pandas as pd
 
 logger = logging.getLogger(__name__)
 
+# orjson parses typical JSON 3-5x faster than the stdlib; both raise a
+# ValueError subclass on malformed input, so callers catch ValueError
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+# Compiled once at import: markdown code fences and the first SQL DML
+# statement (DOTALL so statements may span lines without any
+# newline-stripping copy of the input)
+_CODE_BLOCK_RE = re.compile(r'```(?:sql)?\s*(.*?)```', re.IGNORECASE | re.DOTALL)
+_SQL_RE = re.compile(r'\b(?:WITH|SELECT|INSERT|UPDATE|DELETE)\b.*?;',
+                     re.IGNORECASE | re.DOTALL)
+
+# Tighter extraction patterns used once the operation type is known, so
+# e.g. an INSERT answer can't be short-circuited by a stray SELECT in
+# the model's commentary
+_SQL_RE_BY_OP = {
+    "SELECT": re.compile(r'\b(?:WITH|SELECT)\b.*?;', re.IGNORECASE | re.DOTALL),
+    "INSERT": re.compile(r'\bINSERT\b.*?;', re.IGNORECASE | re.DOTALL),
+    "UPDATE": re.compile(r'\bUPDATE\b.*?;', re.IGNORECASE | re.DOTALL),
+    "DELETE": re.compile(r'\bDELETE\b.*?;', re.IGNORECASE | re.DOTALL),
+}
+
+# Cap for the in-memory generated-SQL result cache
+_SQL_CACHE_MAX = 1024
+
+# On-disk layer under the in-memory cache, so hits survive restarts
+_DISK_CACHE_PATH = ".sql_agent_cache.db"
+
+# Micro-batching window: up to B_MAX requests arriving within TAU seconds
+# are dispatched together so concurrent traffic shares one batch
+_BATCH_MAX = 8
+_BATCH_WINDOW_S = 0.010
+
+# Canonical phrasings that map straight to SQL templates, matched against
+# the normalized (lowercased, punctuation-stripped) query. A hit skips
+# the LLM entirely
+_TPL_SELECT_ALL_RE = re.compile(r"^(?:show|list|get|display)(?: me)?(?: all)?(?: the)? (\w+)$")
+_TPL_COUNT_RE = re.compile(r"^count(?: all| the)? (\w+)$")
+_TPL_COUNT_BY_RE = re.compile(r"^count(?: all| total)? (\w+) by (\w+)$")
+
+# Phrases that signal multi-table or aggregation-heavy queries, used by the
+# complexity router to decide when the full crew pipeline is worth it
+_COMPLEX_HINTS = (
+    "join", "group by", "grouped", "average", "avg", "compare",
+    "for each", "per ", "trend", "percentage", "ratio", "correlat"
+)
+
+# Task descriptions, frozen once at import. The prose is invariant; only
+# the small ${...} slots change per call, so substitute() fills a few
+# placeholders instead of re-building thousands of characters of f-string
+# per query.
+_ANALYSIS_TMPL = string.Template("""${prefix}Analyze the natural language query given at the end and identify:
+                1. The main entities/tables involved
+                2. The type of operation (SELECT, INSERT, UPDATE, DELETE)
+                3. Any filtering conditions
+                4. Any aggregation requirements
+                5. Any sorting requirements
+
+                Provide a detailed analysis in JSON format:
+                {
+                    "entities": ["list of main tables"],
+                    "operation": "SELECT/INSERT/UPDATE/DELETE",
+                    "filters": ["list of filtering conditions"],
+                    "aggregations": ["list of aggregation functions needed"],
+                    "sorting": ["list of sorting requirements"],
+                    "joins": ["list of required table joins"]
+                }
+
+                Query: ${query}""")
+
+_GENERATION_TMPL = string.Template("""${prefix}Generate a PostgreSQL SQL query based on the analysis and the database schema above.
+
+                Query Analysis:
+                ${analysis}
+
+                Pay close attention to the table relationships, foreign keys, data types and constraints in the schema context when joining or filtering.
+
+                Instructions:
+                ${instructions}
+
+                Natural Language Query: ${query}
+
+                Generate the SQL query:""")
+
+# Labeled-batch generation: N queries share one prompt (and one prefill
+# of the schema/examples prefix), and the answer is split back apart on
+# the [SQLk] tags
+_BATCH_GEN_TMPL = string.Template("""${prefix}Generate one PostgreSQL SQL query for EACH of the ${count} natural language queries below.
+
+                Instructions:
+                1. Apply the database schema above for proper table relationships
+                2. Generate syntactically correct PostgreSQL SQL
+                3. Answer every query, in order, and nothing else
+                4. Start each answer with its tag on its own line: [SQL1], [SQL2], ...
+                5. End each SQL statement with a semicolon
+
+                Queries:
+                ${queries}""")
+
+_BATCH_SQL_TAG_RE = re.compile(r'\[SQL(\d+)\]', re.IGNORECASE)
+
+# Single repair turn used when the local parser rejects a generated
+# statement; far cheaper than a standing validation agent
+_REPAIR_TMPL = string.Template("""The following PostgreSQL query failed to parse.
+
+                Query:
+                ${sql}
+
+                Parser error:
+                ${error}
+
+                Fix the syntax error and return ONLY the corrected SQL query, no explanations.""")
+
+# Operation-specific instruction blocks. The generic block spent tokens
+# on guidance irrelevant to most queries (INSERT key handling for a
+# SELECT, aggregation advice for a DELETE); picking one block per
+# operation keeps the prompt shorter and the guidance on point.
+_GEN_PROMPTS = {
+    "SELECT": """1. Use the analysis to understand requirements
+                2. Apply database context for proper table relationships
+                3. Generate syntactically correct PostgreSQL SQL
+                4. Include proper JOINs, WHERE clauses, and aggregations
+                5. Self-check the query for syntax errors and valid table/column references before answering
+                6. Return ONLY the SQL query, no explanations""",
+    "INSERT": """1. Use the analysis to understand which table and columns receive the data
+                2. List the target columns explicitly in the INSERT statement
+                3. Generate syntactically correct PostgreSQL SQL
+                4. For primary keys use increment of the existing keys
+                5. Self-check the statement for syntax errors and valid table/column references before answering
+                6. Return ONLY the SQL query, no explanations""",
+    "UPDATE": """1. Use the analysis to understand which rows and columns change
+                2. Always include a WHERE clause matching the user's conditions
+                3. Only SET the columns the user asked to change
+                4. Generate syntactically correct PostgreSQL SQL
+                5. Self-check the statement for syntax errors and valid table/column references before answering
+                6. Return ONLY the SQL query, no explanations""",
+    "DELETE": """1. Use the analysis to understand which rows should be removed
+                2. Always include a WHERE clause; never delete all rows unless explicitly requested
+                3. Generate syntactically correct PostgreSQL SQL
+                4. Self-check the statement for syntax errors and valid table/column references before answering
+                5. Return ONLY the SQL query, no explanations""",
+}
+
+# Keyword sniff for the operation type; whole-word matches only, so e.g.
+# "status updates" doesn't read as an UPDATE. Anything ambiguous reads
+# as a SELECT, which is by far the common case
+_OP_HINTS = (
+    ("INSERT", re.compile(r"\b(?:insert|add a|add new|create a new record|register a new)\b")),
+    ("UPDATE", re.compile(r"\b(?:update|change|modify|set the|rename)\b")),
+    ("DELETE", re.compile(r"\b(?:delete|remove|drop the record|erase)\b")),
+)
+
+
 class SQLAgent:
     """Main SQL Agent class using CrewAI framework."""
     
-    def __init__(self, config_path: str = "config/database_config.json"):
+    def __init__(self, config_path: str = "config/database_config.json",
+                 verbose: bool = False):
         """Initialize SQL Agent with all components."""
         self.config_path = config_path
+        self.verbose = verbose
         self.db_manager = DatabaseManager(config_path)
         self.ollama_manager = OllamaManager(config_path)
-        self.llm = self.ollama_manager.llm
         self._setup_logging()
-        
-        # Load sample queries for context
-        self.sample_queries = self._load_sample_queries()
-        
-        # Initialize agents
-        self.agents = self._create_agents()
+
+        # Sample queries and the examples context are cached_property
+        # values: callers that only execute SQL or test connections never
+        # pay for reading and parsing the samples file
+
+        # Schema cache; the schema is effectively static within a session,
+        # so avoid re-introspecting the database per query
+        self._schema_cache: Optional[Dict[str, Any]] = None
+        self._prompt_prefix: Optional[str] = None
+
+        # Memo of joined schema-context strings per table subset; queries
+        # over the same tables reuse the built string outright
+        self._context_memo: Dict[frozenset, str] = {}
+
+        # Repeated questions are common; a hit here turns a multi-LLM-call
+        # pipeline into a dict lookup. Keyed on the normalized query plus
+        # a schema fingerprint so DDL changes auto-invalidate
+        self._sql_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+        # Persistent layer under the in-memory cache: repeated questions
+        # still hit after a process restart. Best effort only — if sqlite
+        # is unavailable the agent runs without it
+        self._disk_lock = threading.Lock()
+        self._disk_cache = self._open_disk_cache()
+
+        # Micro-batching state, created lazily inside the running loop
+        # and rebuilt if that loop goes away
+        self._batch_queue: Optional[asyncio.Queue] = None
+        self._batcher_task: Optional[asyncio.Task] = None
+        self._batch_loop: Optional[asyncio.AbstractEventLoop] = None
 
     def _setup_logging(self):
         try:
-            with open(self.config_path, 'r') as f:
-                config = json.load(f)
+            with open(self.config_path, 'rb') as f:
+                config = _json_loads(f.read())
             logging_config = config.get("logging", {})
 
             level_str = logging_config.get("level", "INFO").upper()
@@ -60,37 +250,60 @@ class SQLAgent:
                 fh.setFormatter(formatter)
                 logger.addHandler(fh)
 
-            logger.info(f"Logging configured: level={level_str}, handlers={handlers}")
+            logger.info("Logging configured: level=%s, handlers=%s", level_str, handlers)
 
         except FileNotFoundError:
             logging.basicConfig(level=logging.INFO)
-            logging.warning(f"Config file {self.config_path} not found. Using basic logging config.")
-        except json.JSONDecodeError as e:
+            logging.warning("Config file %s not found. Using basic logging config.", self.config_path)
+        except ValueError as e:
             logging.basicConfig(level=logging.INFO)
-            logging.error(f"Invalid JSON in config file {self.config_path}: {str(e)}")
+            logging.error("Invalid JSON in config file %s: %s", self.config_path, e)
         except Exception as e:
             logging.basicConfig(level=logging.INFO)
-            logging.error(f"Unexpected error during logging setup: {str(e)}")
+            logging.error("Unexpected error during logging setup: %s", e)
         
-    def _load_sample_queries(self) -> List[Dict[str, str]]:
-        """Load sample queries from JSON file."""
+    @cached_property
+    def sample_queries(self) -> List[Dict[str, str]]:
+        """Sample queries, loaded from JSON on first access."""
         try:
-            with open("data/sample_queries.json", 'r') as f:
-                data = json.load(f)
+            with open("data/sample_queries.json", 'rb') as f:
+                data = _json_loads(f.read())
                 return data.get("queries", [])
         except FileNotFoundError:
             logger.warning("Sample queries file not found. Using empty list.")
             return []
-        except json.JSONDecodeError:
+        except ValueError:
             logger.error("Invalid JSON in sample queries file.")
             return []
     
+    @cached_property
+    def llm(self) -> OllamaLLM:
+        """The single LLM instance shared by all CrewAI agents.
+
+        CrewAI doesn't call OllamaLLM._call — it reads .model and routes
+        through litellm, which requires a provider-prefixed name
+        ("ollama/<model>"). The manager's own client keeps the raw model
+        name that the direct /api/generate paths need, so the agents get
+        their own instance with the prefix; HTTP traffic still rides the
+        module-level keep-alive client in ollama_llm either way.
+        """
+        return OllamaLLM(
+            base_url=self.ollama_manager.base_url,
+            model=f"ollama/{self.ollama_manager.model}",
+        )
+
+    @cached_property
+    def agents(self) -> Dict[str, Agent]:
+        """CrewAI agents, built once on first generation call.
+
+        Callers that only execute SQL or export results never pay for
+        agent construction.
+        """
+        return self._create_agents()
+
     def _create_agents(self) -> Dict[str, Agent]:
         """Create CrewAI agents for different roles."""
 
-        # self.llm = OllamaLLM(model="llama3.2:latest", base_url="http://localhost:11434")
-        self.llm = OllamaLLM(provider="ollama", model="ollama/llama3.2:latest", base_url="http://localhost:11434")
-        print(self.llm)
         # SQL Analyst Agent
         sql_analyst = Agent(
             role="SQL Analyst",
@@ -98,19 +311,7 @@ class SQLAgent:
             backstory="""You are an expert SQL analyst with years of experience in 
             database design and query optimization. You excel at understanding user 
             requirements and translating them into database operations.""",
-            verbose=True,
-            allow_delegation=False,
-            llm=self.llm
-        )
-        
-        # Database Expert Agent
-        db_expert = Agent(
-            role="Database Expert",
-            goal="Understand database schema and provide context for SQL generation",
-            backstory="""You are a database expert who knows PostgreSQL inside and out. 
-            You understand table relationships, data types, and can provide valuable 
-            context about the database structure.""",
-            verbose=True,
+            verbose=self.verbose,
             allow_delegation=False,
             llm=self.llm
         )
@@ -122,33 +323,13 @@ class SQLAgent:
             backstory="""You are a senior SQL developer who writes clean, efficient, 
             and correct PostgreSQL queries. You follow best practices and ensure 
             queries are optimized for performance.""",
-            verbose=True,
+            verbose=self.verbose,
             allow_delegation=False,
             llm=self.llm
         )
         
-        # Query Validator Agent
-        # query_validator = Agent(
-        #     role="Query Validator",
-        #     goal="Validate SQL queries for correctness and optimization",
-        #     backstory="""You are a SQL validation expert who ensures queries are 
-        #     syntactically correct, follow best practices, and are optimized for 
-        #     the specific database schema.""",
-        #     verbose=True,
-        #     allow_delegation=False,
-        #     llm=self.llm
-        # )
-
-        # return {
-        #     "sql_analyst": sql_analyst,
-        #     "db_expert": db_expert,
-        #     "sql_developer": sql_developer,
-        #     "query_validator": query_validator
-        # }
-        
         return {
             "sql_analyst": sql_analyst,
-            "db_expert": db_expert,
             "sql_developer": sql_developer
         }
     
@@ -160,169 +341,571 @@ class SQLAgent:
         """Test connection to Ollama service."""
         return self.ollama_manager.test_connection()
     
+    def _get_schema(self) -> Dict[str, Any]:
+        """Return the database schema, introspecting at most once."""
+        if self._schema_cache is None:
+            self._schema_cache = self.db_manager.get_database_schema()
+        return self._schema_cache
+
+    def invalidate_schema_cache(self):
+        """Drop cached schema and prompt prefix (e.g. after DDL changes)."""
+        self._schema_cache = None
+        self._prompt_prefix = None
+        self._context_memo.clear()
+
+    def _get_prompt_prefix(self) -> str:
+        """Invariant prompt prefix shared by every task description.
+
+        Built once per session and placed byte-for-byte at the start of
+        each prompt, so Ollama/llama.cpp can reuse the KV cache for the
+        schema and examples prefill across calls instead of recomputing
+        thousands of identical tokens per request.
+        """
+        if self._prompt_prefix is None:
+            schema_text = self.db_manager.schema_prompt
+            if not schema_text:
+                schema_text = self._create_schema_context(
+                    list(self._get_schema()["tables"].keys()))
+            self._prompt_prefix = (
+                f"Database Schema Context:\n{schema_text}\n\n"
+                f"Example Queries for Reference:\n{self._examples_context}\n\n"
+            )
+        return self._prompt_prefix
+
     def _create_schema_context(self, relevant_tables: List[str]) -> str:
-        """Create schema context for the given tables."""
+        """Create schema context for the given tables from prebuilt blocks.
+
+        DatabaseManager renders each table's block once at schema-load
+        time, and the joined string is memoized per table subset, so a
+        repeat of the same subset is a single dict lookup. Blocks are
+        joined in the block dict's (schema) order so equal subsets yield
+        byte-identical context regardless of ranking order.
+        """
         try:
-            schema = self.db_manager.get_database_schema()
-            context_parts = []
-            
-            for table_name in relevant_tables:
-                if table_name in schema["tables"]:
-                    table_info = schema["tables"][table_name]
-                    
-                    # Table header
-                    context_parts.append(f"Table: {table_name}")
-                    
-                    # Columns
-                    columns = []
-                    for col in table_info["columns"]:
-                        nullable = "NULL" if col["nullable"] else "NOT NULL"
-                        default = f" DEFAULT {col['default']}" if col["default"] else ""
-                        columns.append(f"  - {col['name']}: {col['type']} {nullable}{default}")
-                    
-                    context_parts.append("Columns:")
-                    context_parts.extend(columns)
-                    
-                    # Primary keys
-                    if table_info["primary_keys"]:
-                        context_parts.append(f"Primary Keys: {', '.join(table_info['primary_keys'])}")
-                    
-                    # Foreign keys
-                    if table_info["foreign_keys"]:
-                        fk_info = []
-                        for fk in table_info["foreign_keys"]:
-                            fk_info.append(f"{', '.join(fk['constrained_columns'])} -> {fk['referred_table']}.{', '.join(fk['referred_columns'])}")
-                        context_parts.append(f"Foreign Keys: {'; '.join(fk_info)}")
-                    
-                    context_parts.append("")  # Empty line for separation
-            
-            return "\n".join(context_parts)
-            
+            key = frozenset(relevant_tables)
+            cached = self._context_memo.get(key)
+            if cached is not None:
+                return cached
+
+            blocks = self.db_manager.get_schema_text_blocks(relevant_tables)
+            context = "\n\n".join(block
+                                  for table_name, block in blocks.items()
+                                  if table_name in key)
+            if len(self._context_memo) < 128:
+                self._context_memo[key] = context
+            return context
+
         except Exception as e:
-            logger.error(f"Error creating schema context: {str(e)}")
+            logger.error("Error creating schema context: %s", e)
             return f"Error: Could not retrieve schema information - {str(e)}"
     
-    def _create_examples_context(self) -> str:
-        """Create examples context from sample queries."""
+    @cached_property
+    def _examples_context(self) -> str:
+        """Examples context string, built once on first use."""
+        return self._build_examples_context()
+
+    def _build_examples_context(self) -> str:
+        """Build the examples context string from sample queries."""
         if not self.sample_queries:
             return "No example queries available."
-        
+
         examples = []
         for i, query_info in enumerate(self.sample_queries[:5], 1):  # Limit to 5 examples
             examples.append(f"Example {i}:")
             examples.append(f"  Natural Language: {query_info['natural_language']}")
             examples.append(f"  SQL: {query_info['sql']}")
             examples.append("")
-        
+
         return "\n".join(examples)
+
+    def _create_examples_context(self) -> str:
+        """Return the examples context built once at init."""
+        return self._examples_context
     
-    def generate_sql(self, natural_language_query: str) -> Dict[str, Any]:
-        """Generate SQL query using CrewAI agents."""
-        
+    def generate_sql(self, natural_language_query: str,
+                     temperature: Optional[float] = None,
+                     max_tokens: Optional[int] = None) -> Dict[str, Any]:
+        """Generate SQL query using CrewAI agents (blocking wrapper).
+
+        The concurrent phase-1 tasks inside generate_sql_async need an
+        event loop; if the caller is already inside one, asyncio.run
+        would raise, so the pipeline is pushed onto a worker thread with
+        its own loop instead (the LLM calls are network-bound, so the
+        thread spends its time with the GIL released).
+
+        temperature/max_tokens apply to this request only; the agent is
+        shared across sessions, so per-request overrides replace mutating
+        the shared LLM client.
+        """
+        coro = self.generate_sql_async(
+            natural_language_query, temperature=temperature,
+            max_tokens=max_tokens)
         try:
-            # Get relevant tables
-            relevant_tables = self.db_manager.get_relevant_tables(natural_language_query)
-            
-            # Create context
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coro)
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, coro).result()
+
+    async def generate_sql_batch(self, queries: List[str]) -> List[Dict[str, Any]]:
+        """Generate SQL for several queries concurrently.
+
+        All pipelines are fired at once with asyncio.gather, overlapping
+        their network round-trips; server-side parallelism scales with
+        OLLAMA_NUM_PARALLEL (keep OLLAMA_MAX_LOADED_MODELS=1 so requests
+        share the resident model).
+        """
+        return await asyncio.gather(
+            *[self.generate_sql_async(query) for query in queries]
+        )
+
+    async def generate_sql_batch_prompted(self, queries: List[str]) -> List[Dict[str, Any]]:
+        """Generate SQL for several queries in one labeled prompt.
+
+        Unlike generate_sql_batch (which overlaps N independent
+        pipelines), this packs all queries into a single generation task
+        tagged [Q1]..[Qk], so the schema/examples prefix is prefixed and
+        prefilled once for the whole batch, and splits the answer back
+        apart on the [SQLk] tags. Each fragment is extracted and
+        syntax-checked independently so one bad answer doesn't fail the
+        batch.
+        """
+        if not queries:
+            return []
+        if len(queries) == 1:
+            return [await self.generate_sql_async(queries[0])]
+
+        # Union of relevant tables across the batch, preserving order
+        relevant_tables: List[str] = []
+        seen = set()
+        for query in queries:
+            for table in self.db_manager.get_relevant_tables(query):
+                if table not in seen:
+                    seen.add(table)
+                    relevant_tables.append(table)
+        schema_context = self._create_schema_context(relevant_tables)
+
+        labeled = "\n".join(f"[Q{i}] {query}"
+                            for i, query in enumerate(queries, 1))
+        batch_task = Task(
+            description=_BATCH_GEN_TMPL.substitute(
+                prefix=self._get_prompt_prefix(),
+                count=len(queries),
+                queries=labeled),
+            agent=self.agents["sql_developer"],
+            expected_output="One tagged PostgreSQL SQL query per input query"
+        )
+        batch_crew = Crew(
+            agents=[self.agents["sql_developer"]],
+            tasks=[batch_task],
+            process=Process.sequential,
+            verbose=self.verbose
+        )
+
+        result = await batch_crew.kickoff_async()
+        raw = getattr(result, "raw", str(result))
+
+        # re.split on the tags yields [preamble, "1", text1, "2", text2, ...]
+        parts = _BATCH_SQL_TAG_RE.split(raw)
+        fragments = {int(idx): text
+                     for idx, text in zip(parts[1::2], parts[2::2])}
+
+        results = []
+        for i, query in enumerate(queries, 1):
+            fragment = fragments.get(i, "")
+            sql_query = self._extract_sql_from_result(fragment) if fragment else None
+            entry = {
+                "success": sql_query is not None,
+                "sql_query": sql_query,
+                "natural_language_query": query,
+                "relevant_tables": relevant_tables,
+                "crew_result": raw,
+                "schema_context": schema_context,
+            }
+            if sql_query:
+                syntax_error = self._check_sql_syntax(sql_query)
+                if syntax_error:
+                    entry["success"] = False
+                    entry["error"] = syntax_error
+            elif not fragment:
+                entry["error"] = f"No [SQL{i}] fragment in batch answer"
+            results.append(entry)
+        return results
+
+    @staticmethod
+    def _normalize_query(nl_query: str) -> str:
+        """Collapse case, punctuation and whitespace so trivial
+        rephrasings ("Show me all users" vs "show me all users.") share
+        a cache key."""
+        return re.sub(r"\s+", " ",
+                      re.sub(r"[^\w\s]", " ", nl_query.lower())).strip()
+
+    def _schema_fingerprint(self) -> str:
+        """Fingerprint of the current schema; changes when DDL changes."""
+        return hashlib.sha256(
+            self.db_manager.schema_prompt.encode("utf-8", "ignore")
+        ).hexdigest()
+
+    def _result_cache_key(self, nl_query: str) -> str:
+        """Cache key for a generated-SQL result."""
+        payload = self._normalize_query(nl_query) + "|" + self._schema_fingerprint()
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _open_disk_cache(self) -> Optional[sqlite3.Connection]:
+        """Open (or create) the persistent result cache."""
+        try:
+            conn = sqlite3.connect(_DISK_CACHE_PATH, check_same_thread=False)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sql_cache "
+                "(key TEXT PRIMARY KEY, result TEXT)")
+            conn.commit()
+            return conn
+        except Exception as e:
+            logger.warning("Persistent SQL cache unavailable: %s", e)
+            return None
+
+    def _disk_cache_get(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """Look a result up in the persistent cache."""
+        if self._disk_cache is None:
+            return None
+        try:
+            with self._disk_lock:
+                row = self._disk_cache.execute(
+                    "SELECT result FROM sql_cache WHERE key = ?",
+                    (cache_key,)).fetchone()
+            return json.loads(row[0]) if row else None
+        except Exception as e:
+            logger.debug("Persistent SQL cache read failed: %s", e)
+            return None
+
+    def _disk_cache_put(self, cache_key: str, result: Dict[str, Any]):
+        """Write a result to the persistent cache (best effort)."""
+        if self._disk_cache is None:
+            return
+        try:
+            # crew_result may be a CrewOutput object; persist its text
+            payload = {k: v for k, v in result.items() if k != "crew_result"}
+            payload["crew_result"] = str(result.get("crew_result", ""))
+            with self._disk_lock:
+                self._disk_cache.execute(
+                    "INSERT OR REPLACE INTO sql_cache (key, result) VALUES (?, ?)",
+                    (cache_key, json.dumps(payload)))
+                self._disk_cache.commit()
+        except Exception as e:
+            logger.debug("Persistent SQL cache write failed: %s", e)
+
+    def _store_sql_result(self, cache_key: Optional[str], result: Dict[str, Any]):
+        """Insert a successful result into the LRU and persistent caches."""
+        if cache_key is None or not result.get("success"):
+            return
+        self._sql_cache[cache_key] = result
+        while len(self._sql_cache) > _SQL_CACHE_MAX:
+            self._sql_cache.popitem(last=False)
+        self._disk_cache_put(cache_key, result)
+
+    @staticmethod
+    def _check_sql_syntax(sql_query: str) -> Optional[str]:
+        """Parse the SQL locally; return the error message, or None if OK.
+
+        sqlglot decides syntax validity in microseconds, replacing the
+        LLM validation round-trip the pipeline used to make. Unexpected
+        parser failures count as OK so an odd construct never blocks a
+        query the database itself might accept.
+        """
+        try:
+            sqlglot.parse_one(sql_query, read="postgres")
+            return None
+        except sqlglot.errors.SqlglotError as e:
+            # Covers TokenizeError (e.g. unterminated string literal) as
+            # well as ParseError
+            return str(e)
+        except Exception:
+            return None
+
+    def _resolve_table(self, word: str, relevant_tables: List[str]) -> Optional[str]:
+        """Match a query word to a known table, tolerating plural forms."""
+        candidates = {word, word + "s", word.rstrip("s")}
+        for table in relevant_tables:
+            if table.lower() in candidates:
+                return table
+        return None
+
+    def _table_has_column(self, table: str, column: str) -> bool:
+        """Check a column name against the cached schema."""
+        try:
+            columns = self._get_schema()["tables"][table]["columns"]
+            return any(col["name"].lower() == column for col in columns)
+        except Exception:
+            return False
+
+    def _try_template(self, nl_query: str,
+                      relevant_tables: List[str]) -> Optional[str]:
+        """Emit canonical SQL for trivial phrasings, or None.
+
+        Handles the "show me all users" / "count total orders by status"
+        class of queries with precompiled patterns, so the common case
+        costs a regex match instead of seconds of LLM time. Tables and
+        columns must resolve against the live schema; anything else
+        falls through to the pipeline.
+        """
+        normalized = self._normalize_query(nl_query)
+
+        match = _TPL_SELECT_ALL_RE.match(normalized)
+        if match:
+            table = self._resolve_table(match.group(1), relevant_tables)
+            if table:
+                return f"SELECT * FROM {table};"
+
+        match = _TPL_COUNT_BY_RE.match(normalized)
+        if match:
+            table = self._resolve_table(match.group(1), relevant_tables)
+            column = match.group(2)
+            if table and self._table_has_column(table, column):
+                return (f"SELECT {column}, COUNT(*) AS count "
+                        f"FROM {table} GROUP BY {column};")
+
+        match = _TPL_COUNT_RE.match(normalized)
+        if match:
+            table = self._resolve_table(match.group(1), relevant_tables)
+            if table:
+                return f"SELECT COUNT(*) AS count FROM {table};"
+
+        return None
+
+    @staticmethod
+    def _sniff_operation(nl_query: str) -> str:
+        """Guess the SQL operation type from the phrasing of the query."""
+        query_lower = nl_query.lower()
+        for operation, hint_re in _OP_HINTS:
+            if hint_re.search(query_lower):
+                return operation
+        return "SELECT"
+
+    def _classify_complexity(self, nl_query: str,
+                             relevant_tables: List[str]) -> str:
+        """Cheap heuristic: SIMPLE single-table lookups skip the crew.
+
+        Anything mentioning joins, grouping or aggregation — or touching
+        more than one table — keeps the full multi-agent pipeline.
+        """
+        query_lower = nl_query.lower()
+        if any(hint in query_lower for hint in _COMPLEX_HINTS):
+            return "COMPLEX"
+        if len(relevant_tables) > 1:
+            return "COMPLEX"
+        return "SIMPLE"
+
+    def generate_sql_stream(self, natural_language_query: str,
+                            early_exit: bool = True):
+        """Stream SQL generation token-by-token.
+
+        Uses the direct single-prompt path (streaming consumers such as
+        st.write_stream can't drive the Crew pipeline) and, with
+        early_exit, closes the HTTP stream as soon as the first complete
+        SQL statement has been captured, so no tokens are decoded for any
+        trailing prose.
+        """
+        relevant_tables = self.db_manager.get_relevant_tables(natural_language_query)
+        schema_context = self._create_schema_context(relevant_tables)
+        examples_context = self._create_examples_context()
+
+        buffer = []
+        stream = self.ollama_manager.generate_sql_stream(
+            natural_language_query, schema_context, examples_context
+        )
+        for token in stream:
+            buffer.append(token)
+            yield token
+            # Only run the statement regex when a semicolon just arrived
+            if early_exit and ';' in token and _SQL_RE.search("".join(buffer)):
+                stream.close()
+                break
+
+    async def generate_sql_queued(self, natural_language_query: str) -> Dict[str, Any]:
+        """Enqueue a query for micro-batched generation.
+
+        Requests arriving within the batch window (_BATCH_WINDOW_S, up to
+        _BATCH_MAX) are coalesced and dispatched together, so concurrent
+        callers amortize the shared-prefix prefill and fill Ollama's
+        server-side parallel slots instead of trickling in one by one.
+        """
+        loop = asyncio.get_running_loop()
+        # The queue and its consumer are bound to one event loop. If the
+        # caller is on a different loop (e.g. back-to-back asyncio.run
+        # calls) or the consumer has died, enqueueing would wait forever,
+        # so rebuild both
+        if (self._batch_queue is None
+                or self._batch_loop is not loop
+                or self._batcher_task is None
+                or self._batcher_task.done()):
+            self._batch_queue = asyncio.Queue()
+            self._batch_loop = loop
+            self._batcher_task = loop.create_task(self._batcher())
+
+        future = loop.create_future()
+        await self._batch_queue.put((natural_language_query, future))
+        return await future
+
+    async def _batcher(self):
+        """Background coroutine that drains the queue in micro-batches."""
+        loop = asyncio.get_running_loop()
+        while True:
+            query, future = await self._batch_queue.get()
+            batch = [(query, future)]
+
+            # Collect whatever else arrives within the window
+            deadline = loop.time() + _BATCH_WINDOW_S
+            while len(batch) < _BATCH_MAX:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(
+                        self._batch_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            results = await self.generate_sql_batch([q for q, _ in batch])
+            for (_, fut), result in zip(batch, results):
+                if not fut.done():
+                    fut.set_result(result)
+
+    async def generate_sql_async(self, natural_language_query: str,
+                                 temperature: Optional[float] = None,
+                                 max_tokens: Optional[int] = None) -> Dict[str, Any]:
+        """Generate SQL query using CrewAI agents.
+
+        Runs an analysis task, then a fused generation + self-check task
+        that consumes the analysis; the schema travels in the shared
+        prompt prefix rather than through a dedicated agent.
+        """
+        try:
+            # Result cache: identical (normalized) questions against the
+            # same schema skip the pipeline entirely
+            try:
+                cache_key = self._result_cache_key(natural_language_query)
+            except Exception:
+                cache_key = None
+
+            if cache_key and cache_key in self._sql_cache:
+                self._sql_cache.move_to_end(cache_key)
+                cached = dict(self._sql_cache[cache_key])
+                cached["cache_hit"] = True
+                return cached
+
+            # Memory miss: check the persistent layer (warm it on a hit).
+            # The key embeds the schema fingerprint, so entries written
+            # against an older schema simply never match
+            if cache_key:
+                disk_hit = self._disk_cache_get(cache_key)
+                if disk_hit is not None:
+                    self._sql_cache[cache_key] = disk_hit
+                    cached = dict(disk_hit)
+                    cached["cache_hit"] = True
+                    return cached
+
+            # Table ranking and the prompt-prefix/schema warm-up are
+            # independent, so overlap them on worker threads; after the
+            # first call the prefix side is a cached-attribute read
+            loop = asyncio.get_running_loop()
+            relevant_tables, prompt_prefix = await asyncio.gather(
+                loop.run_in_executor(
+                    None, self.db_manager.get_relevant_tables,
+                    natural_language_query),
+                loop.run_in_executor(None, self._get_prompt_prefix),
+            )
+
+            # Create context (returned to callers for debugging; the
+            # prompts use the shared prefix below)
             schema_context = self._create_schema_context(relevant_tables)
-            examples_context = self._create_examples_context()
-            
-            # Create tasks
+
+            # Template fast path: canonical phrasings become SQL without
+            # touching the LLM at all
+            template_sql = self._try_template(natural_language_query,
+                                              relevant_tables)
+            if template_sql is not None:
+                template_result = {
+                    "success": True,
+                    "sql_query": template_sql,
+                    "natural_language_query": natural_language_query,
+                    "relevant_tables": relevant_tables,
+                    "crew_result": None,
+                    "schema_context": schema_context,
+                    "path": "template"
+                }
+                self._store_sql_result(cache_key, template_result)
+                return template_result
+
+            # Operation type drives the specialized generation
+            # instructions and the extraction pattern below
+            operation = self._sniff_operation(natural_language_query)
+
+            # Simple single-table queries don't need the multi-agent
+            # pipeline: one well-prompted call produces equivalent SQL in
+            # a quarter of the round-trips
+            if self._classify_complexity(natural_language_query, relevant_tables) == "SIMPLE":
+                response = await self.ollama_manager.agenerate_sql(
+                    natural_language_query, schema_context,
+                    self._examples_context,
+                    temperature=temperature, max_tokens=max_tokens
+                )
+                sql_query = self._extract_sql_from_result(response, operation)
+                simple_result = {
+                    "success": sql_query is not None,
+                    "sql_query": sql_query,
+                    "natural_language_query": natural_language_query,
+                    "relevant_tables": relevant_tables,
+                    "crew_result": response,
+                    "schema_context": schema_context,
+                    "complexity": "SIMPLE",
+                    "path": "llm"
+                }
+                self._store_sql_result(cache_key, simple_result)
+                return simple_result
+
+            # Create tasks. Each description starts with the shared
+            # byte-identical prefix (schema + examples) and puts the
+            # variable query at the end, maximizing prefill KV-cache reuse
             analysis_task = Task(
-                description=f"""Analyze the following natural language query and identify:
-                1. The main entities/tables involved
-                2. The type of operation (SELECT, INSERT, UPDATE, DELETE)
-                3. Any filtering conditions
-                4. Any aggregation requirements
-                5. Any sorting requirements
-                
-                Query: {natural_language_query}
-                
-                Database Schema Context:
-                {schema_context}
-                
-                Provide a detailed analysis in JSON format:
-                {{
-                    "entities": ["list of main tables"],
-                    "operation": "SELECT/INSERT/UPDATE/DELETE",
-                    "filters": ["list of filtering conditions"],
-                    "aggregations": ["list of aggregation functions needed"],
-                    "sorting": ["list of sorting requirements"],
-                    "joins": ["list of required table joins"]
-                }}""",
+                description=_ANALYSIS_TMPL.substitute(
+                    prefix=prompt_prefix, query=natural_language_query),
                 agent=self.agents["sql_analyst"],
                 expected_output="JSON analysis of the query requirements"
             )
-            
-            schema_task = Task(
-                description=f"""Based on the analysis, provide detailed database context including:
-                1. Table relationships and foreign keys
-                2. Data types and constraints
-                3. Sample data patterns
-                4. Indexing considerations
-                
-                Schema Context:
-                {schema_context}
-                
-                Provide database-specific insights for SQL generation.""",
-                agent=self.agents["db_expert"],
-                expected_output="Database context and insights"
+
+            analysis_crew = Crew(
+                agents=[self.agents["sql_analyst"]],
+                tasks=[analysis_task],
+                process=Process.sequential,
+                verbose=self.verbose
             )
-            
+
+            analysis_result = await analysis_crew.kickoff_async()
+            analysis_output = getattr(analysis_result, "raw", str(analysis_result))
+
+            # Fused generation + self-check task, replacing the separate
+            # validation round-trip. The schema lives in the shared
+            # prefix, so no agent restates it
             generation_task = Task(
-                description=f"""Generate a PostgreSQL SQL query based on the analysis and database context.
-                
-                Natural Language Query: {natural_language_query}
-                
-                Example Queries for Reference:
-                {examples_context}
-                
-                Instructions:
-                1. Use the analysis to understand requirements
-                2. Apply database context for proper table relationships
-                3. Generate syntactically correct PostgreSQL SQL
-                4. Include proper JOINs, WHERE clauses, and aggregations
-                5. Return ONLY the SQL query, no explanations
-                6. For Insert queries use increment of primary keys
-                
-                Generate the SQL query:""",
+                description=_GENERATION_TMPL.substitute(
+                    prefix=prompt_prefix,
+                    analysis=analysis_output,
+                    instructions=_GEN_PROMPTS[operation],
+                    query=natural_language_query),
                 agent=self.agents["sql_developer"],
                 expected_output="Valid PostgreSQL SQL query"
             )
-            
-            # validation_task = Task(
-            #     description="""Validate the generated SQL query for:
-            #     1. Syntax correctness
-            #     2. Proper table and column references
-            #     3. Efficient structure
-            #     4. Best practices adherence
-                
-            #     Provide validation result and any suggestions for improvement.""",
-            #     agent=self.agents["query_validator"],
-            #     expected_output="SQL validation result and suggestions"
-            # )
-            
-            # # Create crew
-            # crew = Crew(
-            #     agents=list(self.agents.values()),
-            #     tasks=[analysis_task, schema_task, generation_task, validation_task],
-            #     process=Process.sequential,
-            #     verbose=True
-            # )
-
-             # Create crew
-            crew = Crew(
-                agents=list(self.agents.values()),
-                tasks=[analysis_task, schema_task, generation_task],
+
+            generation_crew = Crew(
+                agents=[self.agents["sql_developer"]],
+                tasks=[generation_task],
                 process=Process.sequential,
-                verbose=True
+                verbose=self.verbose
             )
-            
-            # Execute crew
-            result = crew.kickoff()
-            # logging.debug("result from crew ", result)
-            sql_str = getattr(result, "raw", None)  # Or replace "output" with actual attribute
-            logging.info("result raw",sql_str)
+
+            result = await generation_crew.kickoff_async()
+            sql_str = getattr(result, "raw", None)
 
             if sql_str is None:
                 logger.error("crew.kickoff() did not return string raw.")
@@ -333,19 +916,49 @@ class SQLAgent:
                 }
 
             # Extract SQL from result
-            sql_query = self._extract_sql_from_result(sql_str) 
-            
-            return {
-                "success": True,
+            sql_query = self._extract_sql_from_result(sql_str, operation)
+
+            # Local syntax gate: on a parse error, give the developer
+            # agent one repair turn with the parser's message
+            if sql_query:
+                syntax_error = self._check_sql_syntax(sql_query)
+                if syntax_error:
+                    logger.warning("Generated SQL failed to parse (%s); attempting repair",
+                                   syntax_error)
+                    repair_task = Task(
+                        description=_REPAIR_TMPL.substitute(
+                            sql=sql_query, error=syntax_error),
+                        agent=self.agents["sql_developer"],
+                        expected_output="Corrected PostgreSQL SQL query"
+                    )
+                    repair_crew = Crew(
+                        agents=[self.agents["sql_developer"]],
+                        tasks=[repair_task],
+                        process=Process.sequential,
+                        verbose=self.verbose
+                    )
+                    repair_result = await repair_crew.kickoff_async()
+                    repaired = self._extract_sql_from_result(
+                        getattr(repair_result, "raw", str(repair_result)),
+                        operation)
+                    if repaired and self._check_sql_syntax(repaired) is None:
+                        sql_query = repaired
+
+            crew_result = {
+                "success": sql_query is not None,
                 "sql_query": sql_query,
                 "natural_language_query": natural_language_query,
                 "relevant_tables": relevant_tables,
                 "crew_result": result,
-                "schema_context": schema_context
+                "schema_context": schema_context,
+                "complexity": "COMPLEX",
+                "path": "llm"
             }
+            self._store_sql_result(cache_key, crew_result)
+            return crew_result
             
         except Exception as e:
-            logger.error(f"Error in SQL generation: {str(e)}")
+            logger.error("Error in SQL generation: %s", e)
             return {
                 "success": False,
                 "error": str(e),
@@ -354,98 +967,94 @@ class SQLAgent:
         
     
 
-    def _extract_sql_from_result(self, result: str) -> str:
+    def _extract_sql_from_result(self, result: str,
+                                 operation: Optional[str] = None) -> str:
         """
-        Try to extract the first valid SQL DML query (SELECT/INSERT/UPDATE/DELETE)
-        from SQL code blocks or inline text.
+        Try to extract the first valid SQL DML query (WITH/SELECT/INSERT/
+        UPDATE/DELETE) from SQL code blocks or inline text. When the
+        expected operation is known, only statements of that type match.
         """
-        # 1. Try to find SQL queries in markdown code blocks first
-        code_blocks = re.findall(r"``````", result, flags=re.IGNORECASE)
-        for block in code_blocks:
-            # Find the first non-DDL query in the block
-            matches = re.findall(r'(?im)^(SELECT|INSERT|UPDATE|DELETE)\s+.*?;', block)
-            if matches:
-                # Return the entire statement
-                sql_stmt_match = re.search(r'(?im)(SELECT|INSERT|UPDATE|DELETE)\s+.*?;', block)
-                if sql_stmt_match:
-                    return sql_stmt_match.group(0).strip()
-        # 2. Fallback: try to find inline SQL query in the main text
-        match = re.search(
-            r'(?i)(SELECT|INSERT|UPDATE|DELETE)\s+.*?;',
-            result.replace('\n',' '),
-        )
+        sql_re = _SQL_RE_BY_OP.get(operation, _SQL_RE)
+
+        # 1. Prefer fenced code blocks
+        for block in _CODE_BLOCK_RE.finditer(result):
+            match = sql_re.search(block.group(1))
+            if match:
+                return match.group(0).strip()
+
+        # 2. Fallback: first inline SQL statement in the main text
+        match = sql_re.search(result)
         if match:
             return match.group(0).strip()
-        # 3. If not found, return None or the whole result (for debugging)
+
+        # 3. If not found, return None (caller handles missing SQL)
         logger.warning("Could not extract SQL query from result.")
         return None
 
-
-    # Usage after getting raw result
-    # sql_query = self._extract_sql_from_result(sql_str)
-    # sql_query should yield "SELECT amount FROM orders WHERE amount > 10000;"
-
-    
-    # def _extract_sql_from_result(self, result: str) -> str:
-    #     """Extract SQL query from crew result."""
-    #     # Look for SQL patterns in the result
-    #     lines = result.split('\n')
-    #     sql_lines = []
-    #     in_sql = False
-        
-    #     for line in lines:
-    #         line = line.strip()
-    #         if not line:
-    #             continue
-                
-    #         # Check if line contains SQL keywords
-    #         if any(keyword in line.upper() for keyword in ['SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH']):
-    #             in_sql = True
-            
-    #         if in_sql:
-    #             sql_lines.append(line)
-                
-    #             # Check if line ends with semicolon
-    #             if line.endswith(';'):
-    #                 break
-        
-    #     if sql_lines:
-    #         return ' '.join(sql_lines)
-    #     else:
-    #         # Fallback: return the entire result
-    #         return result.strip()
-
     def dataframe_to_excel_bytes(self, df: pd.DataFrame) -> BytesIO:
-        """Convert DataFrame to Excel as a BytesIO buffer for download."""
+        """Convert DataFrame to Excel as a BytesIO buffer for download.
+
+        xlsxwriter in constant_memory mode streams rows into the buffer
+        and discards them, so memory tracks the I/O buffer rather than
+        one cell object per value as with the default writer.
+        """
         output = BytesIO()
-        with pd.ExcelWriter(output, engine="openpyxl") as writer:
+        with pd.ExcelWriter(output, engine="xlsxwriter",
+                            engine_kwargs={"options": {"constant_memory": True}}) as writer:
             df.to_excel(writer, index=False)
         output.seek(0)
         return output
+
+    def dataframe_to_csv_bytes(self, df: pd.DataFrame) -> BytesIO:
+        """Convert DataFrame to CSV as a BytesIO buffer for download.
+
+        CSV serialization is several times faster than any Excel writer;
+        prefer this for large results when the consumer doesn't need a
+        workbook.
+        """
+        return BytesIO(df.to_csv(index=False).encode())
     
-    def execute_sql(self, sql_query: str) -> Dict[str, Any]:
-        """Execute SQL query and return results."""
+    def execute_sql(self, sql_query: str, fmt: str = "split") -> Dict[str, Any]:
+        """Execute SQL query and return results.
+
+        fmt="split" (default) returns data as a list of row lists next
+        to the columns list — no per-row dicts, no repeated key strings.
+        fmt="columns" returns {column: values}; fmt="records" keeps the
+        old row-dict payload for callers that want named rows (rebuild
+        one lazily with dict(zip(columns, row)) otherwise).
+        """
         try:
             df = self.db_manager.execute_query(sql_query)
-            return {
+            result = {
                 "success": True,
-                "data": df.to_dict('records'),
                 "columns": df.columns.tolist(),
                 "row_count": len(df)
             }
+            if fmt == "records":
+                result["data"] = df.to_dict('records')
+            elif fmt == "columns":
+                result["data"] = {col: df[col].to_numpy().tolist()
+                                  for col in df.columns}
+            else:
+                result["data"] = df.to_numpy(copy=False).tolist()
+            return result
         except Exception as e:
-            logger.error(f"Error executing SQL: {str(e)}")
+            logger.error("Error executing SQL: %s", e)
             return {
                 "success": False,
                 "error": str(e)
             }
     
     def close(self):
-        """Close database connection."""
-        self.db_manager.close() 
+        """Close database connection and the persistent cache."""
+        self.db_manager.close()
+        if self._disk_cache is not None:
+            try:
+                self._disk_cache.close()
+            except Exception:
+                pass
         
 
 if __name__ == "__main__":
     sql_agent = SQLAgent()
-    sql_agent._create_agents()
     print(sql_agent.agents)
\ No newline at end of file
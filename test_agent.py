@@ -13,14 +13,25 @@ sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
 
 from sql_agent import SQLAgent
 
+# One agent shared by all tests; building it per test repeated the full
+# config/client setup three times
+_AGENT = None
+
+
+def get_agent() -> SQLAgent:
+    """Return the shared test agent, building it on first use."""
+    global _AGENT
+    if _AGENT is None:
+        _AGENT = SQLAgent()
+    return _AGENT
 
 
 def test_connections():
     """Test database and Ollama connections."""
     print("🔍 Testing connections...")
-    
-    agent = SQLAgent()
-    
+
+    agent = get_agent()
+
     # Test database connection
     print("Testing database connection...")
 
@@ -51,9 +62,9 @@ def test_connections():
 def test_sql_generation():
     """Test SQL generation with sample queries."""
     print("\n🚀 Testing SQL generation...")
-    
-    agent = SQLAgent()
-    
+
+    agent = get_agent()
+
     if not agent.connect_database():
         print("❌ Cannot test SQL generation - database not connected")
         return False
@@ -94,9 +105,9 @@ def test_sql_generation():
 def test_schema_extraction():
     """Test database schema extraction."""
     print("\n📊 Testing schema extraction...")
-    
-    agent = SQLAgent()
-    
+
+    agent = get_agent()
+
     if not agent.connect_database():
         print("❌ Cannot test schema extraction - database not connected")
         return False
@@ -140,9 +151,5 @@ def main():
     print("\n🎉 Your CrewAI SQL Agent is ready to use!")
     print("Run 'streamlit run app.py' to start the web interface.")
 
-    sql_agent = SQLAgent()
-    sql_agent._create_agents()
-    print(sql_agent.agents)
-
 if __name__ == "__main__":
     main() 
\ No newline at end of file